@@ -30,7 +30,11 @@ class System_fittable(System):
         self.ny = sys_data.ny
         self.init_model_done = True
 
-    def fit(self, train_sys_data, auto_fit_norm=True, **kwargs):
+    def fit(self, train_sys_data, auto_fit_norm=True, already_normed=False, **kwargs):
+        if already_normed: #skips the copy of norm.transform, the norm should already be fitted
+            assert self.init_model_done and train_sys_data.normed, 'already_normed=True requires an initilized model and a normed train_sys_data'
+            self._fit(train_sys_data, **kwargs)
+            return
         if self.init_model_done==False:
             self.init_model(train_sys_data, auto_fit_norm=auto_fit_norm)            
         self._fit(self.norm.transform(train_sys_data), **kwargs)
@@ -62,6 +66,7 @@ class System_torch(System_fittable):
     (i) init_nets(nu, ny) which returns the network parameters, 
     (ii) make_training_data(sys_data, **loss_kwargs)` which converts the normed sys_data into training data (list of numpy arrays),
     (iii) loss(*training_data, **loss_kwargs) which returns the loss using the current training data
+    The batch tensors passed to loss may be non-contiguous, use .reshape and not .view when merging the batch dimension (e.g. yfuture.reshape(-1, ny)).
     '''
     def init_nets(self, nu, ny):
         '''Defined in subclass and initializes networks and returns the parameters
@@ -99,7 +104,8 @@ class System_torch(System_fittable):
         Parameters
         ----------
         training_data_batch : list
-            batch of the training data returned by make_training_data and converted to torch arrays
+            batch of the training data returned by make_training_data and converted to torch arrays. 
+            These tensors may be non-contiguous, use .reshape and not .view when merging the batch dimension.
         loss_kwargs : dict
             loss function settings passed into .fit
         '''
@@ -151,14 +157,31 @@ class System_torch(System_fittable):
                     warnings.warn('Fitting the norm due to auto_fit_norm=True')
                 self.norm.fit(sys_data)
         self.init_nets(self.nu, self.ny)
+        self._torch_attribute_names_cache = None #the networks have been added (the cache could have been filled before, e.g. by .cpu())
         self.to_device(device=device)
         parameters_and_optim = [{**item,**parameters_optimizer_kwargs.get(name,{})} for name,item in self.parameters_with_names.items()]
         self.optimizer = self.init_optimizer(parameters_and_optim, **optimizer_kwargs)
         self.scheduler = self.init_scheduler(**scheduler_kwargs)
         self.bestfit = float('inf')
         self.Loss_val, self.Loss_train, self.batch_id, self.time, self.epoch_id = np.array([]), np.array([]), np.array([]), np.array([]), np.array([])
+        self._n_logged = 0
+        self._torch_attribute_names_cache = None #the optimizer and scheduler have been added
         self.init_model_done = True
 
+    def _torch_attribute_names(self):
+        '''Returns the (cached) names of the nn.Module, nn.Parameter and torch.optim.Optimizer attributes of self
+
+        Notes
+        -----
+        The cache is reset in init_model and after make_training_data in .fit. Set self._torch_attribute_names_cache = None 
+        when adding networks elsewhere. Sorted to have the same order as dir(self).
+        '''
+        names = self.__dict__.get('_torch_attribute_names_cache')
+        if names is None:
+            names = [d for d in sorted(vars(self)) if isinstance(getattr(self,d), (nn.Module, nn.Parameter, torch.optim.Optimizer))]
+            self._torch_attribute_names_cache = names
+        return names
+
     @property
     def parameters(self):
         return [item for key,item in self.parameters_with_names.items()]
@@ -168,10 +191,9 @@ class System_torch(System_fittable):
             excluded_nets = self.excluded_nets_from_parameters
         else:
             excluded_nets = []
-        nns = {d:{'params':self.__getattribute__(d).parameters()} for d in dir(self) if \
-            d not in ['parameters_with_names','parameters']+excluded_nets and isinstance(self.__getattribute__(d),nn.Module   )}
-        pars= {d:{'params':self.__getattribute__(d)}              for d in dir(self) if \
-            d not in ['parameters_with_names','parameters']+excluded_nets and isinstance(self.__getattribute__(d),nn.Parameter)}
+        names = [d for d in self._torch_attribute_names() if d not in excluded_nets]
+        nns = {d:{'params':getattr(self,d).parameters()} for d in names if isinstance(getattr(self,d),nn.Module   )}
+        pars= {d:{'params':getattr(self,d)}              for d in names if isinstance(getattr(self,d),nn.Parameter)}
         return {**nns,**pars}
 
 
@@ -189,10 +211,10 @@ class System_torch(System_fittable):
         '10-step-NMAE_sys_norm'
         '10-step-MSE'
         'X-step-{last/average}-{mode}'  #like this
+        'loss' (only available in .fit, the average of self.loss on the validation data)
         
         #todo;
         User given callback. (overwrite this function?)
-        'loss'  #todo
         'sim-inno' #todo
         '''
         if validation_measure.find('sim')==0:
@@ -221,7 +243,8 @@ class System_torch(System_fittable):
 
     def fit(self, train_sys_data, val_sys_data, epochs=30, batch_size=256, loss_kwargs={}, \
             auto_fit_norm=True, validation_measure='sim-NRMS', optimizer_kwargs={}, concurrent_val=False, cuda=False, \
-            timeout=None, verbose=1, sqrt_train=True, num_workers_data_loader=0, print_full_time_profile=False, scheduler_kwargs={}):
+            timeout=None, verbose=1, sqrt_train=True, num_workers_data_loader=0, print_full_time_profile=False, scheduler_kwargs={}, \
+            precision='fp32', compile_loss=False, ddp=False, ddp_kwargs={}, channels_last=False, already_normed=False):
         '''The batch optimization method with parallel validation, 
 
         Parameters
@@ -238,6 +261,7 @@ class System_torch(System_fittable):
             If true will use self.norm.fit(train_sys_data) which will fit it element wise. 
         validation_measure : str
             Specify which measure should be used for validation, e.g. 'sim-RMS', '10-step-last-RMS', 'sim-NRMS_sys_norm', ect. See self.cal_validation_error for details.
+            'loss' will use self.loss on the validation data (created by self.make_training_data) which is evaluated on the device without moving the networks.
         optimizer_kwargs : dict
             The Keyword Arguments to be passed on to init_optimizer. notes; init_optimizer['optimizer'] is the optimization function used (default torch.Adam)
             and optimizer_kwargs['parameters_optimizer_kwargs'] the learning rates and such for the different elements of the models. see https://pytorch.org/docs/stable/optim.html
@@ -249,15 +273,31 @@ class System_torch(System_fittable):
         timeout : None or number
             Alternative to epochs to run until a set amount of time has past. 
         verbose : int
-            Set to 0 for a silent run
+            Set to 0 for a silent run and to 2 to also print the time spend on the loss and on getting the data (which times every batch)
         sqrt_train : boole
             will sqrt the loss while printing
         num_workers_data_loader : int
             see https://pytorch.org/docs/stable/data.html
         print_full_time_profile : boole
-            will print the full time profile, useful for debugging and basic process optimization. 
+            will print the full time profile, useful for debugging and basic process optimization. (times every batch)
         scheduler_kwargs : dict
             learning rate scheduals are a work in progress.
+        precision : str
+            'fp32' (default), 'tf32', 'bf16' or 'fp16'. With cuda, 'tf32' allows TensorFloat-32 matmuls (tensor cores on Ampere or newer GPUs), 
+            'bf16' and 'fp16' additionally run self.loss in autocast with that dtype where 'fp16' also uses a GradScaler. 
+            Note that the GradScaler does not support closures, hence optimizers which require a closure (e.g. LBFGS) cannot be used with 'fp16'.
+        compile_loss : boole
+            If true will use torch.compile(self.loss) during training which fuses kernels and reduces the launch overhead (requires torch>=2.0). 
+            The first few batches will be slow due to the compilation.
+        ddp : boole
+            If true will train with torch.nn.parallel.DistributedDataParallel in an already initialized process group, use self.fit_ddp instead which initializes the process group. 
+        ddp_kwargs : dict
+            The Keyword Arguments passed to DistributedDataParallel (e.g. find_unused_parameters=True)
+        channels_last : boole
+            If true will convert the networks and the 4D training arrays to the channels last memory format which can be faster for convolutional networks.
+        already_normed : boole
+            If true train_sys_data is assumed to be already transformed by self.norm.transform (i.e. train_sys_data.normed==True) which skips the copy 
+            of the full data set when resuming training multiple times. Only allowed if the model is already initialized since the norm is fitted on the unnormed data.
         
         Notes
         -----
@@ -269,22 +309,50 @@ class System_torch(System_fittable):
         The default checkpoint location is "C:/Users/USER/AppData/Local/deepSI/checkpoints" for windows and ~/.deepSI/checkpoints/ for unix like.
         These can be loaded manually using sys.load_checkpoint("_best") or "_last". (For this to work the sys.unique_code needs to be set to the correct string)
         '''
+        cpu_copy = None
         def validation(train_loss=None, time_elapsed_total=None):
-            self.eval(); self.cpu()
-            Loss_val = self.cal_validation_error(val_sys_data, validation_measure=validation_measure)
-            self.Loss_val.append(Loss_val)
-            self.Loss_train.append(train_loss)
-            self.time.append(time_elapsed_total)
-            self.batch_id.append(self.batch_counter)
-            self.epoch_id.append(self.epoch_counter)
+            nonlocal cpu_copy
+            wrapped = self._ddp_unwrap() if ddp else {} #networks are validated and saved without the DistributedDataParallel wrappers
+            if validation_measure=='loss': #on the device, no copies needed
+                self.eval()
+                with torch.inference_mode():
+                    Loss_val = self.loss(*data_val, **loss_kwargs).item()
+                self.train()
+            else:
+                if cuda: #validated with a cpu copy of the networks such that the system (and the optimizer state) can stay on the device
+                    cpu_copy = self._cpu_copy(cpu_copy)
+                    val_sys = cpu_copy
+                else:
+                    val_sys = self
+                val_sys.eval()
+                Loss_val = val_sys.cal_validation_error(val_sys_data, validation_measure=validation_measure)
+                val_sys.train()
+            self._log_append(Loss_val, train_loss, time_elapsed_total)
             if self.bestfit>=Loss_val:
                 self.bestfit = Loss_val
                 self.checkpoint_save_system()
-            if cuda: 
-                self.cuda()
-            self.train()
+            for d, net in wrapped.items():
+                setattr(self, d, net)
             return Loss_val
         
+        assert not (concurrent_val and validation_measure=='loss'), 'validation_measure="loss" is not supported with concurrent_val'
+        if already_normed:
+            assert self.init_model_done, 'already_normed=True requires an initilized model (init_model_done=True) since the norm is fitted on the unnormed data'
+            assert train_sys_data.normed, 'already_normed=True but train_sys_data is not normed, use self.norm.transform(train_sys_data)'
+
+        ########## Distributed ##########
+        if ddp:
+            assert torch.distributed.is_initialized(), 'ddp=True requires an initialized process group, use .fit_ddp(...) instead'
+            assert not concurrent_val, 'concurrent_val is not supported with ddp'
+            rank, world_size = torch.distributed.get_rank(), torch.distributed.get_world_size()
+            seed_and_code = [torch.randint(0, 2**31, (1,)).item(), self.unique_code] #the same shuffle seed and checkpoint names on all processes
+            torch.distributed.broadcast_object_list(seed_and_code, src=0)
+            seed, self.unique_code = seed_and_code
+        else:
+            rank, world_size, seed = 0, 1, 0
+        if rank!=0: #only the main process prints
+            verbose = 0
+
         ########## Initialization ##########
         if self.init_model_done==False:
             if verbose: print('Initilizing the model and optimizer')
@@ -308,43 +376,84 @@ class System_torch(System_fittable):
             self.cuda()
         self.train()
 
+        ########## Precision ##########
+        assert precision in ['fp32','tf32','bf16','fp16'], f'precision={precision} should be one of "fp32", "tf32", "bf16" or "fp16"'
+        assert precision!='fp16' or cuda, 'precision="fp16" requires cuda=True'
+        assert precision!='fp16' or not isinstance(self.optimizer, torch.optim.LBFGS), 'precision="fp16" uses a GradScaler which does not support optimizers which require a closure (e.g. LBFGS)'
+        if channels_last:
+            for d in self._torch_attribute_names():
+                if isinstance(getattr(self, d), nn.Module):
+                    getattr(self, d).to(memory_format=torch.channels_last)
+        autocast_dtype = {'bf16':torch.bfloat16, 'fp16':torch.float16}.get(precision)
+        autocast_device = 'cuda' if cuda else 'cpu'
+        if precision=='fp16':
+            scaler = torch.amp.GradScaler('cuda') if hasattr(torch.amp, 'GradScaler') else torch.cuda.amp.GradScaler()
+        else:
+            scaler = None
+
+        loss_fn = torch.compile(self.loss, fullgraph=False, dynamic=False) if compile_loss else self.loss #not saved on self since it cannot be copied or pickled
+
+        self._n_logged = min(getattr(self, '_n_logged', len(self.Loss_val)), len(self.Loss_val))
+        self._log_trim() #removes any left over preallocated entries (e.g. after a crash)
         self.epoch_counter = 0 if len(self.epoch_id)==0 else self.epoch_id[-1]
         self.batch_counter = 0 if len(self.batch_id)==0 else self.batch_id[-1]
         extra_t            = 0 if len(self.time)    ==0 else self.time[-1] #correct timer after restart
 
         ########## Getting the data ##########
-        data_train = self.make_training_data(self.norm.transform(train_sys_data), **loss_kwargs)
+        data_train = self.make_training_data(train_sys_data if already_normed else self.norm.transform(train_sys_data), **loss_kwargs)
+        self._torch_attribute_names_cache = None #make_training_data can add networks
+        if validation_measure=='loss': #placed on the device once
+            data_val = self.make_training_data(self.norm.transform(val_sys_data), **loss_kwargs)
+            assert not isinstance(data_val, Dataset), 'validation_measure="loss" does not support a Dataset returned by make_training_data'
+            data_val = [torch.as_tensor(d, dtype=torch.float32, device='cuda' if cuda else 'cpu') for d in data_val]
         if not isinstance(data_train, Dataset) and verbose: print_array_byte_size(sum([d.nbytes for d in data_train]))
 
-        #### transforming it back to a list to be able to append. ########
-        self.Loss_val, self.Loss_train, self.batch_id, self.time, self.epoch_id = list(self.Loss_val), list(self.Loss_train), list(self.batch_id), list(self.time), list(self.epoch_id)
+        #### preallocating the logs (grown if needed) ########
+        self._log_reserve(epochs+1 if timeout is None else 0)
 
         #### init monitoring values ########
         Loss_acc_val, N_batch_acc_val, val_counter, best_epoch, batch_id_start = 0, 0, 0, 0, self.batch_counter #to print the frequency of the validation step.
         N_training_samples = len(data_train) if isinstance(data_train, Dataset) else len(data_train[0])
+        N_training_samples = N_training_samples//world_size #per process
         batch_size = min(batch_size, N_training_samples)
         N_batch_updates_per_epoch = N_training_samples//batch_size
         if verbose>0: 
             print(f'N_training_samples = {N_training_samples}, batch_size = {batch_size}, N_batch_updates_per_epoch = {N_batch_updates_per_epoch}')
         
         ### convert to dataset ###
+        train_sampler = None
         if isinstance(data_train, Dataset):
             persistent_workers = False if num_workers_data_loader==0 else True
-            data_train_loader = DataLoader(data_train, batch_size=batch_size, drop_last=True, shuffle=True, \
-                                   num_workers=num_workers_data_loader, persistent_workers=persistent_workers)
+            if ddp:
+                from torch.utils.data.distributed import DistributedSampler
+                train_sampler = DistributedSampler(data_train, num_replicas=world_size, rank=rank, shuffle=True, seed=seed, drop_last=True)
+            data_train_loader = DataLoader(data_train, batch_size=batch_size, drop_last=True, shuffle=train_sampler is None, sampler=train_sampler, \
+                                   num_workers=num_workers_data_loader, persistent_workers=persistent_workers, pin_memory=cuda)
         else: #add my basic DataLoader
-            data_train_loader = My_Simple_DataLoader(data_train, batch_size=batch_size) #is quite a bit faster for low data situations
+            data_train_loader = My_Simple_DataLoader(data_train, batch_size=batch_size, device='cuda' if cuda else 'cpu', \
+                                                     rank=rank, world_size=world_size, seed=seed) #is quite a bit faster for low data situations
+
+        if ddp:
+            self._ddp_wrap(cuda=cuda, **ddp_kwargs)
 
         if concurrent_val:
             self.remote_start(val_sys_data, validation_measure)
             self.remote_send(float('nan'), extra_t)
-        else: #start with the initial validation 
-            validation(train_loss=float('nan'), time_elapsed_total=extra_t) #also sets current model to cuda
+        elif rank==0: #start with the initial validation 
+            validation(train_loss=float('nan'), time_elapsed_total=extra_t)
             if verbose: 
-                print(f'Initial Validation {validation_measure}=', self.Loss_val[-1])
+                print(f'Initial Validation {validation_measure}=', self.Loss_val[self._n_logged-1])
 
+        allow_tf32_old = torch.backends.cuda.matmul.allow_tf32, torch.backends.cudnn.allow_tf32
+        cudnn_benchmark_old = torch.backends.cudnn.benchmark
         try:
+            if cuda and precision!='fp32':
+                torch.backends.cuda.matmul.allow_tf32 = torch.backends.cudnn.allow_tf32 = True
+            if cuda: #the batches have a fixed size, hence the fastest cudnn algorithms only need to be found once
+                torch.backends.cudnn.benchmark = True
             t = Tictoctimer()
+            profile = verbose>1 or print_full_time_profile
+            tb = t if profile else Tictoctimer_disabled() #the timer used for each batch, disabled to reduce the overhead
             start_t = time.time() #time keeping
             epochsrange = range(epochs) if timeout is None else itertools.count(start=0)
             if timeout is not None and verbose>0: 
@@ -354,57 +463,73 @@ class System_torch(System_fittable):
                 bestfit_old = self.bestfit #to check if a new lowest validation loss has been achieved
                 Loss_acc_epoch = 0.
                 t.start()
-                t.tic('data get')
+                if train_sampler is not None:
+                    train_sampler.set_epoch(epoch)
+                tb.tic('data get')
                 for train_batch in data_train_loader:
-                    if cuda:
-                        train_batch = [b.cuda() for b in train_batch]
-                    t.toc('data get')
+                    if cuda: #does nothing for My_Simple_DataLoader, the batches of a Dataset are in pinned memory such that the copy can overlap with the computations
+                        train_batch = [b.to('cuda', non_blocking=True) for b in train_batch]
+                    if channels_last:
+                        train_batch = [b.to(memory_format=torch.channels_last) if b.dim()==4 else b for b in train_batch]
+                    tb.toc('data get')
                     def closure(backward=True):
-                        t.toc('optimizer start')
-                        t.tic('loss')
-                        Loss = self.loss(*train_batch, **loss_kwargs)
-                        t.toc('loss')
+                        tb.toc('optimizer start')
+                        tb.tic('loss')
+                        with torch.autocast(autocast_device, dtype=autocast_dtype, enabled=autocast_dtype is not None):
+                            Loss = loss_fn(*train_batch, **loss_kwargs)
+                        tb.toc('loss')
                         if backward:
-                            t.tic('zero_grad')
-                            self.optimizer.zero_grad()
-                            t.toc('zero_grad')
-                            t.tic('backward')
-                            Loss.backward()
-                            t.toc('backward')
-                        t.tic('stepping')
+                            tb.tic('zero_grad')
+                            self.optimizer.zero_grad(set_to_none=True) #frees the gradients instead of filling them with zeros
+                            tb.toc('zero_grad')
+                            tb.tic('backward')
+                            if scaler is None:
+                                Loss.backward()
+                            else:
+                                scaler.scale(Loss).backward()
+                            tb.toc('backward')
+                        tb.tic('stepping')
                         return Loss
 
-                    t.tic('optimizer start')
-                    training_loss = self.optimizer.step(closure).item()
-                    t.toc('stepping')
+                    tb.tic('optimizer start')
+                    if scaler is None:
+                        training_loss = self.optimizer.step(closure).detach().float() #float32 since an autocast loss can be in low precision
+                    else: #the GradScaler does not support closures 
+                        training_loss = closure().detach().float()
+                        scaler.step(self.optimizer)
+                        scaler.update()
+                    tb.toc('stepping')
                     if self.scheduler:
-                        t.tic('scheduler')
+                        tb.tic('scheduler')
                         self.scheduler.step()
-                        t.tic('scheduler')
-                    Loss_acc_val += training_loss
+                        tb.toc('scheduler')
+                    Loss_acc_val += training_loss #accumulated on the device to avoid a synchronization each batch
                     Loss_acc_epoch += training_loss
                     N_batch_acc_val += 1
                     self.batch_counter += 1
                     self.epoch_counter += 1/N_batch_updates_per_epoch
 
-                    t.tic('val')
+                    tb.tic('val')
                     if concurrent_val and self.remote_recv(): ####### validation #######
-                        self.remote_send(Loss_acc_val/N_batch_acc_val, time.time()-start_t+extra_t)
+                        self.remote_send(float(Loss_acc_val)/N_batch_acc_val, time.time()-start_t+extra_t)
                         Loss_acc_val, N_batch_acc_val, val_counter = 0., 0, val_counter + 1
-                    t.toc('val')
-                    t.tic('data get')
-                t.toc('data get')
+                    tb.toc('val')
+                    tb.tic('data get')
+                tb.toc('data get')
 
                 ########## end of epoch clean up ##########
-                train_loss_epoch = Loss_acc_epoch/N_batch_updates_per_epoch
+                if ddp: #average over all processes such that all processes take the same decisions
+                    torch.distributed.all_reduce(Loss_acc_epoch)
+                    Loss_acc_epoch = Loss_acc_epoch/world_size
+                train_loss_epoch = float(Loss_acc_epoch)/N_batch_updates_per_epoch
                 if np.isnan(train_loss_epoch):
                     if verbose>0: print(f'&&&&&&&&&&&&& Encountered a NaN value in the training loss at epoch {epoch}, breaking from loop &&&&&&&&&&')
                     break
 
                 t.tic('val')
-                if not concurrent_val:
+                if not concurrent_val and rank==0:
                     validation(train_loss=train_loss_epoch, \
-                               time_elapsed_total=time.time()-start_t+extra_t) #updates bestfit and goes back to cpu and back
+                               time_elapsed_total=time.time()-start_t+extra_t) #updates bestfit
                 t.toc('val')
                 t.pause()
 
@@ -420,10 +545,13 @@ class System_torch(System_fittable):
                     else: #else print validation time use
                         valfeqstr = f''
                     trainstr = f'sqrt loss {train_loss_epoch**0.5:7.4}' if sqrt_train and train_loss_epoch>=0 else f'loss {train_loss_epoch:7.4}'
-                    Loss_val_now = self.Loss_val[-1] if len(self.Loss_val)!=0 else float('nan')
+                    Loss_val_now = self.Loss_val[self._n_logged-1] if self._n_logged!=0 else float('nan')
                     Loss_str = f'Epoch {epoch+1:4}, {trainstr}, Val {validation_measure} {Loss_val_now:6.4}'
-                    loss_time = (t.acc_times['loss'] + t.acc_times['optimizer start'] + t.acc_times['zero_grad'] + t.acc_times['backward'] + t.acc_times['stepping'])  /t.time_elapsed
-                    time_str = f'Time Loss: {loss_time:.1%}, data: {t.acc_times["data get"]/t.time_elapsed:.1%}, val: {t.acc_times["val"]/t.time_elapsed:.1%}{valfeqstr}'
+                    if profile:
+                        loss_time = (t.acc_times['loss'] + t.acc_times['optimizer start'] + t.acc_times['zero_grad'] + t.acc_times['backward'] + t.acc_times['stepping'])  /t.time_elapsed
+                        time_str = f'Time Loss: {loss_time:.1%}, data: {t.acc_times["data get"]/t.time_elapsed:.1%}, val: {t.acc_times["val"]/t.time_elapsed:.1%}{valfeqstr}'
+                    else:
+                        time_str = f'Time val: {t.acc_times["val"]/t.time_elapsed:.1%}{valfeqstr}'
                     self.batch_feq = (self.batch_counter - batch_id_start)/(time.time() - start_t)
                     batch_str = (f'{self.batch_feq:4.1f} batches/sec' if (self.batch_feq>1 or self.batch_feq==0) else f'{1/self.batch_feq:4.1f} sec/batch')
                     print(f'{Loss_str}, {time_str}, {batch_str}')
@@ -431,12 +559,21 @@ class System_torch(System_fittable):
                         print('Time profile:',t.percent())
 
                 ####### Timeout Breaking ##########
-                if timeout is not None:
-                    if time.time() >= start_t+timeout:
-                        break
+                timed_out = timeout is not None and time.time() >= start_t+timeout
+                if ddp: #bestfit and the timeout of the main process are used by all processes
+                    bestfit_and_timed_out = [self.bestfit, timed_out]
+                    torch.distributed.broadcast_object_list(bestfit_and_timed_out, src=0)
+                    self.bestfit, timed_out = bestfit_and_timed_out
+                if timed_out:
+                    break
         except KeyboardInterrupt:
             print('Stopping early due to a KeyboardInterrupt')
+        finally: #the torch.backends flags are process wide
+            torch.backends.cuda.matmul.allow_tf32, torch.backends.cudnn.allow_tf32 = allow_tf32_old
+            torch.backends.cudnn.benchmark = cudnn_benchmark_old
 
+        if ddp:
+            self._ddp_unwrap()
         self.train(); self.cpu()
         del data_train_loader
 
@@ -446,14 +583,17 @@ class System_torch(System_fittable):
             if self.remote_recv(wait=True):
                 if verbose: print('Recv done... ',end='')
                 if N_batch_acc_val>0:
-                    self.remote_send(Loss_acc_val/N_batch_acc_val, time.time()-start_t+extra_t)
+                    self.remote_send(float(Loss_acc_val)/N_batch_acc_val, time.time()-start_t+extra_t)
                     self.remote_recv(wait=True)
             self.remote_close()
             if verbose: print('Done!')
 
         
-        self.Loss_val, self.Loss_train, self.batch_id, self.time, self.epoch_id = np.array(self.Loss_val), np.array(self.Loss_train), np.array(self.batch_id), np.array(self.time), np.array(self.epoch_id)
-        self.checkpoint_save_system(name='_last')
+        self._log_trim()
+        if rank==0:
+            self.checkpoint_save_system(name='_last')
+        if ddp: #wait until the main process has saved the checkpoints
+            torch.distributed.barrier()
         try:
             self.checkpoint_load_system(name='_best')
         except FileNotFoundError:
@@ -461,19 +601,72 @@ class System_torch(System_fittable):
         if verbose: 
             print(f'Loaded model with best known validation {validation_measure} of {self.bestfit:6.4} which happened on epoch {best_epoch} (epoch_id={self.epoch_id[-1] if len(self.epoch_id)>0 else 0:.2f})')
 
+    ########## Validation logs ##########
+    def _log_reserve(self, n_extra):
+        '''Resizes the logs (Loss_val, Loss_train, time, batch_id and epoch_id) to have room for n_extra more entries than self._n_logged'''
+        n = self._n_logged
+        for name in ['Loss_val', 'Loss_train', 'time', 'batch_id', 'epoch_id']:
+            log = np.full(n + n_extra, np.nan)
+            log[:n] = getattr(self, name)[:n]
+            setattr(self, name, log)
+
+    def _log_append(self, Loss_val, Loss_train, time_now):
+        '''Writes Loss_val, Loss_train, time_now and the current batch and epoch counter in the preallocated logs'''
+        if self._n_logged==len(self.Loss_val): #full
+            self._log_reserve(max(self._n_logged, 16))
+        i = self._n_logged
+        self.Loss_val[i], self.Loss_train[i], self.time[i], self.batch_id[i], self.epoch_id[i] = \
+            Loss_val, Loss_train, time_now, self.batch_counter, self.epoch_counter
+        self._n_logged += 1
+
+    def _log_trim(self):
+        '''Removes the unused preallocated entries of the logs'''
+        n = self._n_logged
+        self.Loss_val, self.Loss_train, self.batch_id, self.time, self.epoch_id = np.array(self.Loss_val[:n]), \
+            np.array(self.Loss_train[:n]), np.array(self.batch_id[:n]).astype(int), np.array(self.time[:n]), np.array(self.epoch_id[:n])
+
+    def fit_ddp(self, train_sys_data, val_sys_data, cuda=False, **kwargs):
+        '''Distributed data parallel version of .fit which is to be started with one process per device using torchrun, 
+        e.g. "torchrun --nproc_per_node=4 my_script.py". 
+
+        Each process trains on its own part of each epoch and the gradients are averaged between the processes
+        by wrapping all networks in torch.nn.parallel.DistributedDataParallel. Validation and checkpointing are only done by the process with rank 0.
+        See .fit for the arguments. 
+
+        Notes
+        -----
+        The checkpoints are used to share the best model at the end of training, hence all processes should have access to the same checkpoint directory (e.g. a single node).
+        The batch_size is the batch size per process. 
+        '''
+        init_process_group = not torch.distributed.is_initialized()
+        if init_process_group:
+            torch.distributed.init_process_group(backend='nccl' if cuda else 'gloo')
+        if cuda:
+            torch.cuda.set_device(int(os.environ.get('LOCAL_RANK', 0)))
+        try:
+            self.fit(train_sys_data, val_sys_data, cuda=cuda, ddp=True, **kwargs)
+        finally:
+            if init_process_group:
+                torch.distributed.destroy_process_group()
+
     ########## Saving and loading ############
     def checkpoint_save_system(self, name='_best', directory=None):
         directory  = get_work_dirs()['checkpoints'] if directory is None else directory
         file = os.path.join(directory,self.name + name + '.pth')
-        torch.save(self.__dict__, file)
+        torch.save({'checkpoint_version':1, 'system_dict':self.__dict__}, file)
     def checkpoint_load_system(self, name='_best', directory=None):
+        '''Loads the checkpoint created by checkpoint_save_system where all tensors are loaded on the cpu'''
         directory  = get_work_dirs()['checkpoints'] if directory is None else directory
         file = os.path.join(directory,self.name + name + '.pth')
         try:
-            self.__dict__ = torch.load(file)
+            import inspect
+            load_kwargs = dict(weights_only=False) if 'weights_only' in inspect.signature(torch.load).parameters else {} #the system is pickled (weights_only exists since torch 1.13)
+            checkpoint = torch.load(file, map_location='cpu', **load_kwargs)
+            self.__dict__ = checkpoint['system_dict'] if 'checkpoint_version' in checkpoint else checkpoint #older checkpoints only contain self.__dict__
             init_model_done = self.init_model_done if hasattr(self,'init_model_done') else True
             if init_model_done:
-                self.Loss_val, self.Loss_train, self.batch_id, self.time, self.epoch_id = np.array(self.Loss_val), np.array(self.Loss_train), np.array(self.batch_id), np.array(self.time), np.array(self.epoch_id)
+                self._n_logged = min(getattr(self, '_n_logged', len(self.Loss_val)), len(self.Loss_val))
+                self._log_trim() #checkpoints during training contain the preallocated logs
                 for i in np.where(np.isnan(self.Loss_train))[0]:
                     if i!=len(self.Loss_train)-1: #if the last is NaN than I will leave it there. Something weird happened like breaking before one validation loop was completed. 
                         self.Loss_train[i] = self.Loss_train[i+1]
@@ -508,10 +701,8 @@ class System_torch(System_fittable):
     def cpu(self):
         self.to_device('cpu')
     def to_device(self,device):
-        for d in dir(self):
-            if d in ['parameters_with_names','parameters']:
-                continue
-            attribute = self.__getattribute__(d)
+        for d in self._torch_attribute_names():
+            attribute = getattr(self, d)
             if isinstance(attribute,(nn.Module,nn.Parameter)):
                 attribute.to(device)
             elif isinstance(attribute, torch.optim.Optimizer):
@@ -520,44 +711,118 @@ class System_torch(System_fittable):
                         if isinstance(item2, torch.Tensor):
                             item[name] = item2.to(device)
     def eval(self):
-        for d in dir(self):
-            attribute = self.__getattribute__(d)
+        for d in self._torch_attribute_names():
+            attribute = getattr(self, d)
             if isinstance(attribute,nn.Module):
                 attribute.eval()
     def train(self):
-        for d in dir(self):
-            attribute = self.__getattribute__(d)
+        for d in self._torch_attribute_names():
+            attribute = getattr(self, d)
             if isinstance(attribute,nn.Module):
                 attribute.train()
 
+    def _cpu_copy(self, copy=None):
+        '''Returns a copy of the system with all the networks on the cpu or updates the networks of an existing copy in-place'''
+        if copy is None: #deepcopy where the memo provides cpu versions of the tensors such that nothing is duplicated on the device
+            memo = {}
+            for d in self._torch_attribute_names():
+                attribute = getattr(self, d)
+                if isinstance(attribute, torch.optim.Optimizer): #the optimizer state is not needed for validation
+                    memo[id(attribute)] = None
+                    continue
+                tensors = [attribute] if isinstance(attribute, nn.Parameter) else itertools.chain(attribute.parameters(), attribute.buffers())
+                for tensor in tensors:
+                    tensor_cpu = tensor.detach().to('cpu', copy=True)
+                    memo[id(tensor)] = nn.Parameter(tensor_cpu, requires_grad=tensor.requires_grad) if isinstance(tensor, nn.Parameter) else tensor_cpu
+            if self.scheduler: #refers to the optimizer
+                memo[id(self.scheduler)] = None
+            copy = deepcopy(self, memo)
+            copy._torch_attribute_names_cache = None #without the optimizer
+            copy.cpu()
+            return copy
+        with torch.no_grad():
+            for d in self._torch_attribute_names():
+                attribute = getattr(self, d)
+                if isinstance(attribute, nn.Module):
+                    getattr(copy, d).load_state_dict(attribute.state_dict())
+                elif isinstance(attribute, nn.Parameter):
+                    getattr(copy, d).copy_(attribute)
+        return copy
+
+    ### DistributedDataParallel ###
+    def _ddp_wrap(self, cuda=False, **ddp_kwargs):
+        '''Wraps all the networks with trainable parameters in DistributedDataParallel'''
+        from torch.nn.parallel import DistributedDataParallel
+        excluded_nets = self.excluded_nets_from_parameters if hasattr(self,'excluded_nets_from_parameters') else []
+        device_ids = [torch.cuda.current_device()] if cuda else None
+        for d in self._torch_attribute_names():
+            if d in excluded_nets:
+                continue
+            attribute = getattr(self, d)
+            if isinstance(attribute, nn.Parameter):
+                assert not attribute.requires_grad, f'ddp only supports trainable parameters inside networks (nn.Module), {d} is a trainable nn.Parameter'
+            elif isinstance(attribute, nn.Module) and not isinstance(attribute, DistributedDataParallel) \
+                    and any(p.requires_grad for p in attribute.parameters()):
+                setattr(self, d, DistributedDataParallel(attribute, device_ids=device_ids, **ddp_kwargs))
+    def _ddp_unwrap(self):
+        '''Removes the DistributedDataParallel wrappers and returns them such that they can be restored with setattr'''
+        from torch.nn.parallel import DistributedDataParallel
+        wrapped = {}
+        for d in self._torch_attribute_names():
+            attribute = getattr(self, d)
+            if isinstance(attribute, DistributedDataParallel):
+                wrapped[d] = attribute
+                setattr(self, d, attribute.module)
+        return wrapped
+
     ########## Remote ##########
     def remote_start(self, val_sys_data, validation_measure):
-        from multiprocessing import Process, Pipe
-        self.remote, work_remote = Pipe()
+        import torch.multiprocessing as mp #sends tensors as shared memory handles instead of pickling their data
+        ctx = mp.get_context('spawn') #safe after cuda has been initialized and the same as on windows
+        self.remote, work_remote = ctx.Pipe()
         self.remote.receiving = False
-        process = Process(target=_worker, args=(work_remote, self.remote, val_sys_data, validation_measure))
+        self.remote.shared_tensors, self.remote.signature = None, None
+        process = ctx.Process(target=_worker, args=(work_remote, self.remote, val_sys_data, validation_measure))
         process.daemon = True  # if the main process crashes, we should not cause things to hang
         process.start()
         work_remote.close()
         self.remote.process = process
 
     def remote_send(self, Loss_acc_val, time_optimize):
+        '''Sends the current system to the validation process.
+
+        The first time (or if the shapes of the state changed, e.g. by the creation of the optimizer state) a copy of the system is send
+        of which all the tensors are in shared memory. Afterwards only the shared memory tensors are updated and a small message is send.
+        The worker only uses the tensors between receiving and replying, hence they are never accessed at the same time.
+        '''
         assert self.remote.receiving==False
-        remote = self.remote
-        del self.remote #remote cannot be copyied by deepcopy
-        copy_self = deepcopy(self)
-        self.remote = remote
-        copy_self.cpu(); copy_self.eval()
-        import pickle
-        if b'__main__' in pickle.dumps(copy_self.scheduler):
-            print('setting scheduler to None for there is some main function found')
-            copy_self.scheduler = False
-        self.remote.send((copy_self, Loss_acc_val, time_optimize)) #time here does not matter
+        tensors, others = self._state_tensors()
+        signature = [(tensor.shape, tensor.dtype) for tensor in tensors], len(others)
+        if signature!=self.remote.signature:
+            remote = self.remote
+            del self.remote #remote cannot be copyied by deepcopy
+            copy_self = deepcopy(self)
+            self.remote = remote
+            copy_self.cpu(); copy_self.eval()
+            import pickle
+            if b'__main__' in pickle.dumps(copy_self.scheduler):
+                print('setting scheduler to None for there is some main function found')
+                copy_self.scheduler = False
+            self.remote.shared_tensors = copy_self._state_tensors()[0]
+            for tensor in self.remote.shared_tensors:
+                tensor.share_memory_()
+            self.remote.signature = signature
+            self.remote.send((copy_self, Loss_acc_val, time_optimize, self.batch_counter, self.epoch_counter, None)) #time here does not matter
+        else:
+            with torch.no_grad():
+                for shared_tensor, tensor in zip(self.remote.shared_tensors, tensors):
+                    shared_tensor.copy_(tensor)
+            self.remote.send((None, Loss_acc_val, time_optimize, self.batch_counter, self.epoch_counter, [state[key] for state, key in others]))
         self.remote.receiving = True
 
     def remote_recv(self,wait=False):
         if self.remote.receiving and (self.remote.poll() or wait):
-            self.Loss_val, self.Loss_train, self.batch_id, self.time, self.epoch_id, self.bestfit = self.remote.recv()
+            self.Loss_val, self.Loss_train, self.batch_id, self.time, self.epoch_id, self._n_logged, self.bestfit = self.remote.recv()
             self.remote.receiving = False
             return True
         else:
@@ -568,6 +833,25 @@ class System_torch(System_fittable):
         self.remote.process.join()
         del self.remote
 
+    def _state_tensors(self):
+        '''Returns all the tensors of the networks, parameters and optimizers in a fixed order 
+        and the other (non-tensor) entries of the optimizer states as a list of (state, key)'''
+        tensors, others = [], []
+        for d in self._torch_attribute_names():
+            attribute = getattr(self, d)
+            if isinstance(attribute, nn.Module):
+                tensors.extend(tensor for tensor in attribute.state_dict(keep_vars=True).values() if isinstance(tensor, torch.Tensor))
+            elif isinstance(attribute, nn.Parameter):
+                tensors.append(attribute)
+            else:
+                for state in attribute.state.values():
+                    for key, item in state.items():
+                        if isinstance(item, torch.Tensor):
+                            tensors.append(item)
+                        else:
+                            others.append((state, key))
+        return tensors, others
+
 import signal
 import logging
 class IgnoreKeyboardInterrupt:
@@ -584,22 +868,27 @@ def _worker(remote, parent_remote, val_sys_data=None, validation_measure='sim-NR
     '''Utility function used by .fit for concurrent validation'''
     
     parent_remote.close()
+    sys = None
     while True:
         try:
             with IgnoreKeyboardInterrupt():
-                sys, Loss_train, time_now = remote.recv() #gets the current network
-                Loss_val = sys.cal_validation_error(val_sys_data, validation_measure)
-                sys.Loss_val.append(Loss_val)
-                sys.Loss_train.append(Loss_train)
-                sys.batch_id.append(sys.batch_counter)
-                sys.time.append(time_now)
-                sys.epoch_id.append(sys.epoch_counter)
+                sys_new, Loss_train, time_now, batch_counter, epoch_counter, others = remote.recv() #gets the current network
+                if sys_new is not None: #a new copy of which the tensors are in shared memory
+                    sys = sys_new
+                else: #the shared memory tensors have been updated by the main process
+                    for (state, key), item in zip(sys._state_tensors()[1], others):
+                        state[key] = item
+                sys.eval() #each round since sys is put back in training mode before saving
+                sys.batch_counter, sys.epoch_counter = batch_counter, epoch_counter
+                with torch.inference_mode(): #the copy is only used for validation
+                    Loss_val = sys.cal_validation_error(val_sys_data, validation_measure)
+                sys._log_append(Loss_val, Loss_train, time_now)
 
                 sys.train() #back to training mode
                 if sys.bestfit >= Loss_val:
                     sys.bestfit = Loss_val
                     sys.checkpoint_save_system('_best')
-                remote.send((sys.Loss_val, sys.Loss_train, sys.batch_id, sys.time, sys.epoch_id, sys.bestfit)) #sends back arrays
+                remote.send((sys.Loss_val, sys.Loss_train, sys.batch_id, sys.time, sys.epoch_id, sys._n_logged, sys.bestfit)) #sends back arrays
         except EOFError: #main process stopped
             break
         except Exception as err: #some other error
@@ -610,6 +899,7 @@ def _worker(remote, parent_remote, val_sys_data=None, validation_measure='sim-NR
 
 
 class Tictoctimer(object):
+    '''Accumulates the time between tic(name) and toc(name) for each name (uses time.perf_counter)'''
     def __init__(self):
         self.time_acc = 0
         self.timer_running = False
@@ -618,26 +908,26 @@ class Tictoctimer(object):
     @property
     def time_elapsed(self):
         if self.timer_running:
-            return self.time_acc + time.time() - self.start_t
+            return self.time_acc + time.perf_counter() - self.start_t
         else:
             return self.time_acc
     
     def start(self):
         self.timer_running = True
-        self.start_t = time.time()
+        self.start_t = time.perf_counter()
         
     def pause(self):
-        self.time_acc += time.time() - self.start_t
+        self.time_acc += time.perf_counter() - self.start_t
         self.timer_running = False
     
     def tic(self,name):
-        self.start_times[name] = time.time()
+        self.start_times[name] = time.perf_counter()
     
     def toc(self,name):
         if self.acc_times.get(name) is None:
-            self.acc_times[name] = time.time() - self.start_times[name]
+            self.acc_times[name] = time.perf_counter() - self.start_times[name]
         else:
-            self.acc_times[name] += time.time() - self.start_times[name]
+            self.acc_times[name] += time.perf_counter() - self.start_times[name]
 
     def percent(self):
         elapsed = self.time_elapsed
@@ -645,31 +935,75 @@ class Tictoctimer(object):
         return ', '.join([key + f' {item/elapsed:.1%}' for key,item in self.acc_times.items()]) +\
                 f', others {1-R/elapsed:.1%}'
         
+class Tictoctimer_disabled(Tictoctimer):
+    '''Tictoctimer which ignores all the tic and toc calls'''
+    def tic(self, name):
+        pass
+    def toc(self, name):
+        pass
+
 class My_Simple_DataLoader:
-    def __init__(self, data, batch_size=32):
-        self.data = [torch.as_tensor(d,dtype=torch.float32) for d in data] #this copies the data again
-        self.ids = np.arange(len(data[0]),dtype=int)
+    def __init__(self, data, batch_size=32, device='cpu', pin_memory=False, rank=0, world_size=1, seed=0):
+        '''Places all the data on the device (if possible) such that batches can be indexed without host to device copies.
+        If the data does not fit on the device the data is kept on the cpu and each batch is gathered in pinned memory and copied to the device asynchronously.
+        With world_size>1 each process iterates over its own part of the data (as torch.utils.data.DistributedSampler).
+        All the arrays are stored as columns of a single (N, total features) tensor such that a batch only requires a single gather.
+        Hence, the batch arrays are (non-contiguous) views, use .reshape in place of .view when merging the batch dimension.'''
+        self.N = len(data[0])
+        self.shapes = [np.shape(d)[1:] for d in data]
+        ends = np.cumsum([int(np.prod(shape)) for shape in self.shapes])
+        self.slices = [slice(end-int(np.prod(shape)), end) for shape, end in zip(self.shapes, ends)]
+        try:
+            self.data = self._to_flat_tensor(data, device) #this copies the data again
+        except getattr(torch.cuda, 'OutOfMemoryError', RuntimeError):
+            print(f'Training data does not fit on {device}, keeping it on the cpu with pinned memory batches')
+            torch.cuda.empty_cache()
+            self.data = self._to_flat_tensor(data, 'cpu')
+            pin_memory = True
         self.batch_size = batch_size
+        self.device = torch.device(device) #where the batches are returned
+        self.pin_memory = pin_memory and self.data.device.type=='cpu'
+        self.rank, self.world_size, self.seed, self.epoch = rank, world_size, seed, 0
+
+    def _to_flat_tensor(self, data, device):
+        flat = torch.empty((self.N, self.slices[-1].stop if self.slices else 0), dtype=torch.float32, device=device)
+        for d, columns in zip(data, self.slices): #converted to float32 while copying, no intermediate copy of each array
+            flat[:, columns] = torch.as_tensor(d).reshape(self.N, columns.stop-columns.start) #explicit width for zero width arrays (e.g. nu=0)
+        return flat
     
     def __iter__(self):
-        np.random.shuffle(self.ids)
-        return My_Simple_DataLoaderIterator(self.data, self.ids, self.batch_size)
+        N, device = self.N, self.data.device
+        if self.world_size==1:
+            ids = torch.randperm(N, device=device) #shuffled on the same device as the data
+        else: #the same permutation for all processes of which each process takes an equal sized part
+            generator = torch.Generator(device=device)
+            generator.manual_seed(self.seed + self.epoch)
+            self.epoch += 1
+            Nper = N//self.world_size
+            ids = torch.randperm(N, generator=generator, device=device)[self.rank*Nper:(self.rank+1)*Nper]
+        N_batches = len(ids)//self.batch_size
+        return My_Simple_DataLoaderIterator(self, ids[:N_batches*self.batch_size].view(N_batches, self.batch_size)) #a row of ids for each batch
+
+    def __len__(self):
+        return (self.N//self.world_size)//self.batch_size
     
 class My_Simple_DataLoaderIterator:
-    def __init__(self, data, ids, batch_size):
-        self.ids = ids #already shuffled
-        self.data = data
-        self.L = len(data[0])
-        self.i = 0
-        self.batch_size = batch_size
+    def __init__(self, loader, batches):
+        self.batches = iter(batches) #already shuffled
+        self.data = loader.data
+        self.slices, self.shapes = loader.slices, loader.shapes
+        self.pin_memory = loader.pin_memory
+        self.device = loader.device
     def __iter__(self):
         return self
     def __next__(self):
-        self.i += self.batch_size
-        if self.i>self.L:
-            raise StopIteration
-        ids_now = self.ids[self.i-self.batch_size:self.i]
-        return [d[ids_now] for d in self.data]
+        ids_now = next(self.batches)
+        if self.pin_memory: #gathered directly into page-locked memory which allows for asynchronous host to device copies
+            batch = torch.index_select(self.data, 0, ids_now, out=torch.empty((len(ids_now), self.data.shape[1]), pin_memory=True))
+            batch = batch.to(self.device, non_blocking=True) #a single copy of the contiguous batch, the arrays are sliced on the device
+        else:
+            batch = self.data[ids_now]
+        return [batch[:, columns].reshape(len(ids_now), *shape) for columns, shape in zip(self.slices, self.shapes)] #views of the batch
 
 def print_array_byte_size(Dsize):
     if Dsize>2**30: 